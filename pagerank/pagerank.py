@@ -1,11 +1,34 @@
 import os
-import random
 import re
 import sys
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Numba is optional, when available the iteration sweep is compiled to native code
+# and parallelized across cores. Without it prange is plain range so the sweep
+# definition still imports cleanly
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
 
 DAMPING = 0.85
 SAMPLES = 10000
 
+# Iteration stops once no pages rank moved more than TOLERANCE in a sweep, a per-page
+# test that does not tighten as the corpus grows the way a summed total would.
+# MAX_ITERATIONS caps the loop the same way networkx's pagerank does
+TOLERANCE = 1e-6
+MAX_ITERATIONS = 100
+
+# Matches the href target of every anchor tag, compiled once at import
+# so crawl does not pay a regex cache lookup per file
+_LINK_RE = re.compile(r"<a\s+(?:[^>]*?)href=\"([^\"]*)\"")
+
 def main():
     if len(sys.argv) != 2:
         sys.exit("Usage: python pagerank.py corpus")
@@ -28,21 +51,21 @@ def crawl(directory):
     """
     pages = dict()
 
-    # Extract all links from HTML files
+    # Extract all links from HTML files, kept as the raw match lists since the full
+    # set of page names is not known until every file has been read
     for filename in os.listdir(directory):
         if not filename.endswith(".html"):
             continue
         with open(os.path.join(directory, filename)) as f:
-            contents = f.read()
-            links = re.findall(r"<a\s+(?:[^>]*?)href=\"([^\"]*)\"", contents)
-            pages[filename] = set(links) - {filename}
+            pages[filename] = _LINK_RE.findall(f.read())
 
-    # Only include links to other pages in the corpus
-    for filename in pages:
-        pages[filename] = set(
-            link for link in pages[filename]
-            if link in pages
-        )
+    # Dedups each pages links and drops self-links and links to pages outside the
+    # corpus, all in a single set build per page
+    pageNames = set(pages)
+    pages = {
+        filename: {link for link in links if link in pageNames and link != filename}
+        for filename, links in pages.items()
+    }
 
     return pages
 
@@ -60,8 +83,11 @@ def transition_model(corpus, page, damping_factor):
     # Set of all pages the current page links to
     pageLinks = corpus[page]
 
-    # List holding all page names
-    pageNames = list(corpus.keys())
+    # Number of pages in the corpus and the chances that do not depend on the page being
+    # rated, computed once instead of on every pass through the loops below
+    pageCount = len(corpus)
+    equalChance = 1 / pageCount
+    randomChance = (1 - damping_factor) / pageCount
 
     # Holds each page as a key and their random rates of being chosen as values, will be returned
     pageChosenRates = {}
@@ -69,18 +95,22 @@ def transition_model(corpus, page, damping_factor):
     # If the current page does not link to any other page, every other page has an equal chance of being chosen
     if len(pageLinks) < 1:
 
-        # Fills chosen rates dict with every page having an equal value of being chosen
-        for pageName in pageNames:
-            pageChosenRates[pageName] = 1 / len(corpus)
+        # Fills chosen rates dict with every page having an equal value of being chosen,
+        # iterating the corpus view directly allocates no page name list
+        for pageName in corpus:
+            pageChosenRates[pageName] = equalChance
     # Else the current page contains links to other pages, page chances will be calculated based on those links
     else:
+        # Chance of a linked page being chosen, every link splits the damping factor evenly
+        linkChance = damping_factor / len(pageLinks)
+
         # For every page, if the page is found in the links on the current page, that pages rate of being chosen
         # is the first formula, else its the second formula
-        for pageName in pageNames:
+        for pageName in corpus:
             if pageName in pageLinks:
-                pageChosenRates[pageName] = damping_factor / len(pageLinks)
+                pageChosenRates[pageName] = linkChance
             else:
-                pageChosenRates[pageName] = (1 - damping_factor) / len(corpus)
+                pageChosenRates[pageName] = randomChance
 
     # Returns a dictionary containing the name of each page as a key and its chance of being chosen as a value
     return pageChosenRates
@@ -95,40 +125,159 @@ def sample_pagerank(corpus, damping_factor, n):
     PageRank values should sum to 1.
     """
 
-    # Holds list of all page names
+    # Converts the corpus to integer ids once, the whole walk below is id based
+    pageNames, linkIds = _index_corpus(corpus)
+    pageCount = len(pageNames)
+
+    # Chance of landing on any given page through the random jump, shared by every row
+    randomChance = (1 - damping_factor) / pageCount
+
+    # Builds the cumulative transition distribution for one page the first time the walk
+    # reaches it and caches it, identical to precomputing every row up front except the
+    # walk never pays to build rows for pages it does not visit. Every row starts at the
+    # random-jump chance, then pages with links get the damping chance split across them
+    @lru_cache(maxsize=None)
+    def cumulative_row(pageId):
+        links = linkIds[pageId]
+        # If the page has no links every page keeps an equal chance of being chosen
+        if len(links) < 1:
+            row = np.full(pageCount, 1 / pageCount)
+        else:
+            row = np.full(pageCount, randomChance)
+            row[links] += damping_factor / len(links)
+        return row.cumsum(dtype=np.float32)
+
+    # Counts how many times each page was visited, missing pages default to zero so no
+    # membership check is needed before incrementing
+    visitCounts = Counter()
+
+    # One PCG64 generator drives the whole walk, created once and reused for every draw
+    rng = np.random.default_rng()
+
+    # Chooses a random page out of all the page names and counts it as the first visit
+    pageChosenId = int(rng.integers(pageCount))
+    visitCounts[pageChosenId] += 1
+
+    # Generates every uniform draw the walk will need in one batched call instead of
+    # calling random.random() once per step, the chain itself still advances one step
+    # at a time since each step depends on the page chosen before it
+    uniformDraws = rng.random(n - 1, dtype=np.float32)
+
+    # For each iteration minus the first one which was randomly chosen, choses a new page based on its
+    # probability of being chosen as given by the precomputed transition rows
+    for draw in uniformDraws:
+
+        # Randomly selects a page based on its probability of being chosen, scaling the draw by the
+        # rows total guards against floating point error pushing the search past the last page
+        cumulativeRow = cumulative_row(pageChosenId)
+        pageChosenId = int(cumulativeRow.searchsorted(draw * cumulativeRow[-1]))
+        visitCounts[pageChosenId] += 1
+
+    # Returns dictionary containing page names as keys and their estimated page ranks as values,
+    # ranks are the amount of times the page was visited / the total amount of pages visited
+    return {pageNames[pageId]: count / n for pageId, count in visitCounts.items()}
+
+def _index_corpus(corpus):
+    """
+    Assign each page an integer id and convert the link structure to id lists.
+
+    Return (pageNames, linkIds) where pageNames[i] is the name of page i
+    and linkIds[i] holds the ids of the pages that page i links to. The
+    hot loops all work on these ids so they never hash a page name,
+    names only reappear in the final result dicts.
+    """
+
+    # Holds list of all page names, a pages index in this list is its integer id
     pageNames = list(corpus.keys())
 
-    # Dict that will hold all page names as keys and their calculated ranks as values, sums to 1.
-    # Will hold amount of times page was chosen in following for loop before being translated to pagerank
-    estimatedPageRanks = {}
+    # Maps each page name to its integer id, only needed while converting the links
+    pageIds = {pageName: pageId for pageId, pageName in enumerate(pageNames)}
 
-    # Chooses a random page out of all the page names and sets 1 to the amount of times it was chosen
-    pageChosen = random.choice(list(corpus.keys()))
-    estimatedPageRanks[pageChosen] = 1
+    # Each pages links as a list of integer ids
+    linkIds = [[pageIds[link] for link in corpus[pageName]] for pageName in pageNames]
 
-    # For each iteration minus the first one which was randomly chosen, choses a new page based on its probability
-    # of being chosen as calculated by transition_model
-    for i in range(n - 1):
+    return pageNames, linkIds
 
-        # Calculates and holds the chances of the next page being chosen
-        pageChances = transition_model(corpus, pageChosen, damping_factor)
 
-        # Randomly selects a page based on its probability of being chosen
-        pageChosen = random.choices(list(pageChances.keys()), weights = list(pageChances.values()), k = 1)[0]
+def _build_link_arrays(corpus):
+    """
+    Invert the corpus into CSR arrays of in-links, built once so the
+    iteration sweeps only ever touch actual edges.
+
+    Return (pageNames, indptr, indices, linkWeights, danglingIds) where
+    row i of the CSR arrays holds 1 / number of links for every page
+    linking to page i, and danglingIds lists pages with no links at all.
+    """
+
+    # Converts the corpus to integer ids once, all array building below is id based
+    pageNames, linkIds = _index_corpus(corpus)
+    pageCount = len(pageNames)
+
+    # Number of links on each page, used to weight the rank a page passes along each link
+    outDegrees = [len(links) for links in linkIds]
+
+    # For each page, collects the ids of the pages that link to it
+    linksToPage = [[] for pageId in range(pageCount)]
+    for sourceId, links in enumerate(linkIds):
+        for targetId in links:
+            linksToPage[targetId].append(sourceId)
+
+    # Flattens the in-link lists into CSR form
+    indptr = [0]
+    indices = []
+    linkWeights = []
+    for pageId in range(pageCount):
+        for sourceId in linksToPage[pageId]:
+            indices.append(sourceId)
+            linkWeights.append(1 / outDegrees[sourceId])
+        indptr.append(len(indices))
+
+    # Ids of pages with no links at all, they are treated as linking to every page in the corpus
+    danglingIds = np.flatnonzero(np.array(outDegrees) < 1).astype(np.int32)
+
+    # 32-bit ids and weights halve the bytes each sweep pulls through the cache, and
+    # float32 precision is comfortably below the per-page convergence tolerance
+    return (
+        pageNames,
+        np.asarray(indptr, dtype=np.int32),
+        np.asarray(indices, dtype=np.int32),
+        np.asarray(linkWeights, dtype=np.float32),
+        danglingIds,
+    )
+
+
+def _iterate_sweep(indptr, indices, linkWeights, ranks, newRanks, danglingIds, damping_factor, pageCount):
+    """
+    Perform one power-iteration sweep over the CSR in-link arrays,
+    writing the result into the preallocated newRanks buffer.
+    Compiled with numba when it is installed.
+    """
+
+    # Rank held by pages with no links, spread evenly across the whole corpus, computed
+    # once per sweep rather than re-testing every pages dangling status inside the row loop
+    danglingSum = 0.0
+    for danglingId in danglingIds:
+        danglingSum += ranks[danglingId]
+    danglingContribution = danglingSum / pageCount
+
+    # First half of the calculation, identical for every page
+    half1 = (1 - damping_factor) / pageCount
+
+    # Sums each pages incoming rank along its in-links, weighted by the linking pages
+    # out-degree. Rows are independent, each reads the old ranks and writes only its own
+    # slot of newRanks, so the loop parallelizes across cores without any locking
+    for pageId in prange(pageCount):
+        linkedRank = 0.0
+        for k in range(indptr[pageId], indptr[pageId + 1]):
+            linkedRank += ranks[indices[k]] * linkWeights[k]
+        newRanks[pageId] = half1 + damping_factor * (linkedRank + danglingContribution)
+
+
+# Compiles the sweep to native code when numba is available, when it is missing
+# iterate_pagerank uses the scipy matrix-vector product instead of this Python loop
+if njit is not None:
+    _iterate_sweep = njit(parallel=True, cache=True, fastmath=True)(_iterate_sweep)
 
-        # If the page that was chosen has not been chosen before adds its key to the ranks dict with a value of 1
-        # else the key is already in the dictionary and it 1 is added to the amount of times that page was chosen
-        if pageChosen not in list(estimatedPageRanks.keys()):
-            estimatedPageRanks[pageChosen] = 1
-        else:
-            estimatedPageRanks[pageChosen] += 1
-    
-    # Assigns page ranks based on amount of times the page was visited / the total amount of pages visited
-    for pageName, pageCount in estimatedPageRanks.items():
-        estimatedPageRanks[pageName] = pageCount / n
-    
-    # Returns dictionary containing page names as keys and their estimated page ranks as values
-    return estimatedPageRanks
 
 def iterate_pagerank(corpus, damping_factor):
     """
@@ -140,66 +289,56 @@ def iterate_pagerank(corpus, damping_factor):
     PageRank values should sum to 1.
     """
 
-    # Holds list of all page names
-    pageNames = list(corpus.keys())
+    # Inverts the corpus into CSR in-link arrays once, so each sweep only touches actual edges
+    pageNames, indptr, indices, linkWeights, danglingIds = _build_link_arrays(corpus)
+    pageCount = len(pageNames)
 
-    # Dict to be returned, key = page name, value = page rank
-    estimatedPageRanks = {}
+    # The scipy matrix is only needed on the fallback path when numba is not installed
+    if njit is None:
+        linkMatrix = csr_matrix((linkWeights, indices, indptr), shape=(pageCount, pageCount))
 
     # Initializes the first half of the calculation
-    half1 = (1 - damping_factor) / len(corpus)
-
-    # Fills ranks dict with all the page names as keys and their initial even rankings as values
-    for pageName in corpus.keys():
-        estimatedPageRanks[pageName] = 1 / len(corpus)
-
-    # Utilizes probability formula to calculate page ranks, breaks when convergence is reached
-    endFlag = False
-    while endFlag == False:
-
-        # Copies the initial page ranks, used for convergence testing later
-        initialValues = estimatedPageRanks.copy()
-
-        # Iterates through each page calculating that pages new page rank
-        for pageName in pageNames:
-
-            # Dict that holds the pages that link to pageName, key = page that links to this one, 
-            # value = total number of links on that page
-            linksToPage = {}
-
-            # Fills linksToPage dict
-            for corpusPageName, links in corpus.items():
-                # If current page being calculated is found in a sites links, adds that site and its number
-                # of links to the linksToPage dict
-                if pageName in links:
-                    linksToPage[corpusPageName] = len(links)
-                # If current page has no links at all, adds that site and a link for every page in the corpus
-                # to the linksToPage dict
-                elif len(links) < 1:
-                    linksToPage[corpusPageName] = len(corpus)
-
-            # Calculates the sum of i as shown in the second half of the equation
-            sum = 0
-            for corpusPageName, links in linksToPage.items():
-                sum += estimatedPageRanks[corpusPageName] / links
-
-            # Finishes calculating second half of the equation
-            half2 = damping_factor * (sum)
-
-            # Utilizes both halfs of the equation to calculate the current pages new page rank
-            estimatedPageRanks[pageName] = half1 + half2
-
-        # Calculates total variation between the initial page ranks and the newly calculated ones
-        totalVariation = 0
-        for corpusPageName, rank in estimatedPageRanks.items():
-            totalVariation += abs(initialValues[corpusPageName] - rank)
-
-        # If variation is within a small margin, ends loop
-        if totalVariation < .001:
-            endFlag = True
-    
+    half1 = (1 - damping_factor) / pageCount
+
+    # Fills the rank vector with the initial even rankings, float32 to match the link arrays.
+    # A second buffer and a scratch array are preallocated once and reused every iteration
+    # instead of copying the ranks for convergence testing
+    estimatedPageRanks = np.full(pageCount, 1 / pageCount, dtype=np.float32)
+    newPageRanks = np.empty_like(estimatedPageRanks)
+    rankDeltas = np.empty_like(estimatedPageRanks)
+
+    # Utilizes probability formula to calculate page ranks, breaks when convergence is
+    # reached, capped at MAX_ITERATIONS sweeps
+    for iteration in range(MAX_ITERATIONS):
+
+        # Calculates every pages new page rank in a single sweep, compiled by numba when
+        # available, otherwise via the scipy matrix-vector product
+        if njit is not None:
+            _iterate_sweep(
+                indptr, indices, linkWeights, estimatedPageRanks, newPageRanks,
+                danglingIds, damping_factor, pageCount
+            )
+        else:
+            # The matvec allocates its result, so reuse that array as the new rank
+            # buffer directly instead of copying it into the preallocated one
+            danglingSum = estimatedPageRanks[danglingIds].sum()
+            newPageRanks = linkMatrix.dot(estimatedPageRanks)
+            newPageRanks += danglingSum / pageCount
+            newPageRanks *= damping_factor
+            newPageRanks += half1
+
+        # Calculates how far each pages rank moved this sweep in the scratch buffer,
+        # then swaps the rank buffers instead of copying
+        np.subtract(newPageRanks, estimatedPageRanks, out=rankDeltas)
+        largestChange = np.abs(rankDeltas, out=rankDeltas).max()
+        estimatedPageRanks, newPageRanks = newPageRanks, estimatedPageRanks
+
+        # If no pages rank moved more than the tolerance, ends loop
+        if largestChange < TOLERANCE:
+            break
+
     # Returns a dict containing the estimated page ranks for each page
-    return estimatedPageRanks
+    return {pageName: float(rank) for pageName, rank in zip(pageNames, estimatedPageRanks)}
 
 
 if __name__ == "__main__":